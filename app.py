@@ -1,19 +1,37 @@
 import os
 import re
-import json
+import sys
 import time
+import threading
+import uuid
+import asyncio
+import hashlib
 import statistics
+import aiohttp
+import diskcache
+import orjson
 import pymysql
+from pymysql.constants import CLIENT
+from dbutils.pooled_db import PooledDB
 import requests
 import numpy as np
-import pandas as pd
 import getpass
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import Flask, render_template, request, redirect, url_for, session, flash
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from datetime import datetime
+from collections import Counter
 from dotenv import load_dotenv
 from kiwipiepy import Kiwi
+from redis import Redis
+from rq import Queue
+
+try:
+    import re2 as _re  # DFA 기반 엔진: 비정상 라인에서도 백트래킹 폭주 없이 선형 시간
+except ImportError:
+    _re = re
 
 # -----------------------
 # [0] 환경 설정 및 초기화
@@ -25,40 +43,58 @@ PERSPECTIVE_API_KEY = os.getenv("PERSPECTIVE_API_KEY")
 app = Flask(__name__)
 app.secret_key = 'echomind_secret_key_secure_random_string'
 
-# Kiwi 형태소 분석기 초기화 (속도 빠름)
-kiwi = Kiwi()
+# Kiwi 형태소 분석기 초기화 (C++ 워커 스레드로 문장 단위 병렬 분석)
+kiwi = Kiwi(num_workers=os.cpu_count() or 4)
 
 # -----------------------
-# [DB 설정] 실행 시 사용자 입력 받기
+# [DB 설정] 환경변수 우선 (gunicorn 등 TTY 없는 워커에서 import가 멈추지 않도록)
 # -----------------------
-print("\n" + "="*40)
-print("   EchoMind DB 접속 설정")
-print("="*40)
-
-# 1. 사용자명 입력 (엔터 치면 기본값 'root')
-input_user = input("DB 사용자명 (기본값 root): ").strip()
-if not input_user:
-    input_user = 'root'
-
-# 2. 비밀번호 입력 (화면에 보이지 않음)
-# 주의: PyCharm 등 일부 IDE의 실행창에서는 getpass가 작동하지 않을 수 있습니다.
-# 그럴 경우 input("DB 비밀번호: ") 로 변경해서 쓰셔도 됩니다.
-try:
-    input_password = getpass.getpass("DB 비밀번호: ").strip()
-except Exception:
-    # getpass가 지원되지 않는 환경(일부 윈도우 콘솔 등)을 위한 예외처리
-    input_password = input("DB 비밀번호 (화면 표시됨): ").strip()
-
-print("-" * 40 + "\n")
-
-db_config = {
-    'host': 'localhost',
-    'user': input_user,      # 입력받은 값 사용
-    'password': input_password, # 입력받은 값 사용
-    'db': 'echomind_db',
-    'charset': 'utf8mb4',
-    'cursorclass': pymysql.cursors.DictCursor
-}
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_USER = os.getenv("DB_USER", "root")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_NAME = os.getenv("DB_NAME", "echomind_db")
+
+def _resolve_db_credentials():
+    """환경변수에 비밀번호가 없고 터미널에서 직접 실행한 경우에만 프롬프트"""
+    global DB_USER, DB_PASSWORD
+    if DB_PASSWORD is not None or not sys.stdin.isatty():
+        return
+    print("\n" + "="*40)
+    print("   EchoMind DB 접속 설정")
+    print("="*40)
+
+    # 1. 사용자명 입력 (엔터 치면 환경변수/기본값 유지)
+    input_user = input(f"DB 사용자명 (기본값 {DB_USER}): ").strip()
+    if input_user:
+        DB_USER = input_user
+
+    # 2. 비밀번호 입력 (화면에 보이지 않음)
+    # 주의: PyCharm 등 일부 IDE의 실행창에서는 getpass가 작동하지 않을 수 있습니다.
+    try:
+        DB_PASSWORD = getpass.getpass("DB 비밀번호: ").strip()
+    except Exception:
+        # getpass가 지원되지 않는 환경(일부 윈도우 콘솔 등)을 위한 예외처리
+        DB_PASSWORD = input("DB 비밀번호 (화면 표시됨): ").strip()
+
+    print("-" * 40 + "\n")
+
+def _db_config():
+    return {
+        'host': DB_HOST,
+        'user': DB_USER,
+        'password': DB_PASSWORD or '',
+        'db': DB_NAME,
+        'charset': 'utf8mb4',
+        'cursorclass': pymysql.cursors.DictCursor,
+        'autocommit': False,
+        # 로그+결과 INSERT를 한 번의 왕복으로 보내기 위한 다중 statement 허용
+        'client_flag': CLIENT.MULTI_STATEMENTS
+    }
+
+# 요청마다 TCP+인증 핸드셰이크를 새로 하지 않도록 커넥션 풀 사용
+# (.close()는 실제 종료가 아니라 풀 반납) — 첫 접속 시점에 생성
+_POOL = None
+_POOL_LOCK = threading.Lock()
 
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'txt', 'csv'}
@@ -67,130 +103,347 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+# 분석 작업 큐 (rq worker로 실행: `rq worker`) — 업로드 요청 스레드를 즉시 반환
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+TASK_QUEUE = Queue(connection=Redis.from_url(REDIS_URL))
+
 # -----------------------
 # [1] 한국어 분석 로직 (Kiwi 적용)
 # -----------------------
-LINE_RE = re.compile(r"^\[(?P<name>.+?)\]\s+\[(?P<time>.*?)\]\s+(?P<msg>.+)$")
-SKIP_TOKENS = {"사진", "이모티콘", "동영상", "삭제된 메시지입니다.", "보이스톡 해요.", "파일"}
+# bytes 패턴: 비매칭/타 화자 라인은 UTF-8 디코드 없이 걸러냄
+LINE_RE = _re.compile(rb"^\[(?P<name>.+?)\]\s+\[(?P<time>.*?)\]\s+(?P<msg>.+)$")
+SKIP_TOKENS = frozenset({"사진", "이모티콘", "동영상", "삭제된 메시지입니다.", "보이스톡 해요.", "파일"})
 
-def parse_kakao_txt(path: str):
-    rows = []
+def iter_target_sentences(path: str, target_name: str):
+    """파싱→화자 필터→정제를 한 번의 스트리밍 패스로 처리 (대상 문장만 메모리에 적재)"""
+    target_b = target_name.encode("utf-8")
     try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        with open(path, "rb", buffering=1 << 20) as f:
             for line in f:
-                line = line.rstrip("\n")
-                m = LINE_RE.match(line)
+                m = LINE_RE.match(line.rstrip(b"\r\n"))
                 if not m:
                     continue
-                rows.append({
-                    "speaker": m.group("name").strip(),
-                    "time": m.group("time"),
-                    "text": m.group("msg").strip(),
-                })
+                if m.group("name").strip() != target_b:
+                    continue
+                txt = m.group("msg").decode("utf-8", "ignore").strip()
+                if not txt or txt in SKIP_TOKENS:
+                    continue
+                cleaned = clean_text(txt)
+                if cleaned:
+                    yield cleaned
     except Exception as e:
         print(f"File parsing error: {e}")
-    return rows
+
+# URL 제거와 ㅋㅋㅋㅋ/ㅎㅎㅎ 제거를 한 번의 스캔으로 융합 (모듈 로드 시 1회 컴파일)
+_CLEAN = _re.compile(r"https?://\S+|[ㅋㅎㅠㅜ]+")
+_WS = _re.compile(r"\s+")
+
+def _clean_repl(m):
+    # URL은 공백으로 치환(단어 경계 유지), 자모 추임새는 통째로 제거
+    return " " if m.group().startswith("http") else ""
 
 def clean_text(t: str) -> str:
-    t = re.sub(r"https?://\S+", " ", t)
-    t = re.sub(r"[ㅋㅎㅠㅜ]+", "", t)  # ㅋㅋㅋㅋ, ㅎㅎㅎ 등 제거
-    t = re.sub(r"\s+", " ", t).strip()
-    return t
+    return _WS.sub(" ", _CLEAN.sub(_clean_repl, t)).strip()
+
+# 스타일 마커 사전 (frozenset: 루프마다 리스트 선형 탐색 대신 O(1) 조회)
+SELF_REF_MORPHS = frozenset({"나", "저", "내", "제", "우리"})
+CERTAINTY_MORPHS = frozenset({"진짜", "정말", "너무", "완전", "확실히", "분명", "반드시", "개"})
+UNCERTAINTY_MORPHS = frozenset({"듯", "나", "가", "글쎄", "아마", "지"})
 
 def analyze_korean_style(sentences):
-    full_text = " ".join(sentences)
-    if not full_text:
+    if not sentences or not any(sentences):
         return {"avg_len": 0, "self_ref": 0, "certainty": 0, "uncertainty": 0, "ttr": 0}
 
-    tokens = kiwi.tokenize(full_text)
-    
-    total_words = len(tokens)
+    # 어절 수는 C 구현인 str.split으로 충분 (형태소 분석 불필요)
+    word_lens = [len(s.split()) for s in sentences]
+    avg_len = sum(word_lens) / len(sentences)
+
+    # 1어절 초단문("ㅇㅇ", "알았어" 등)은 Kiwi를 건너뛰어도 지표 왜곡이 없음
+    long_sents = [s for s, wl in zip(sentences, word_lens) if wl >= 2]
+    short_words = [w for s, wl in zip(sentences, word_lens) if wl < 2 for w in s.split()]
+
+    # 리스트 입력으로 넘기면 Kiwi가 워커 스레드에 문장을 분배해 병렬 분석
+    # (반환값은 1회용 이터레이터이므로 forms/tags를 한 번의 패스로 수집)
+    forms = []
+    tags = []
+    if long_sents:
+        for toks in kiwi.tokenize(long_sents):
+            for t in toks:
+                forms.append(t.form)
+                tags.append(t.tag)
+
+    total_words = len(forms) + len(short_words)
     if total_words == 0: total_words = 1
-    
-    self_ref_count = 0
-    certainty_count = 0
-    uncertainty_count = 0
-    unique_morphs = set()
-
-    for t in tokens:
-        morph = t.form
-        tag = t.tag
-        unique_morphs.add(morph)
-        
-        if morph in ["나", "저", "내", "제", "우리"] and tag.startswith('N'):
-            self_ref_count += 1
-            
-        if morph in ["진짜", "정말", "너무", "완전", "확실히", "분명", "반드시", "개"] and tag.startswith('M'):
-            certainty_count += 1
-            
-        if morph in ["듯", "나", "가", "글쎄", "아마", "지"] and (tag.startswith('E') or tag.startswith('M')):
-            uncertainty_count += 1
+
+    unique_morphs = set(forms)
+    unique_morphs.update(short_words)
+
+    pairs = list(zip(forms, tags))
+    self_ref_count = sum(1 for f, tg in pairs if f in SELF_REF_MORPHS and tg[0] == 'N')
+    certainty_count = sum(1 for f, tg in pairs if f in CERTAINTY_MORPHS and tg[0] == 'M')
+    uncertainty_count = sum(1 for f, tg in pairs if f in UNCERTAINTY_MORPHS and tg[0] in 'EM')
 
     return {
-        "avg_len": sum(len(s.split()) for s in sentences) / len(sentences) if sentences else 0,
+        "avg_len": avg_len,
         "self_ref": self_ref_count / total_words,
         "certainty": certainty_count / total_words,
         "uncertainty": uncertainty_count / total_words,
         "ttr": len(unique_morphs) / total_words
     }
 
+HF_API_URL = "https://router.huggingface.co/hf-inference/models/cardiffnlp/twitter-xlm-roberta-base-sentiment"
+HF_CONCURRENCY = 8  # 동시 요청 수 제한 (무료 할당량 보호)
+
+# 같은 발화("ㅇㅇ", "알았어" 등)는 업로드 간에도 반복되므로 결과를 디스크에 재사용
+CACHE_TTL = 30 * 86400  # 30일
+HF_CACHE = diskcache.Cache(os.path.join("cache", "hf"))
+PERSP_CACHE = diskcache.Cache(os.path.join("cache", "persp"))
+
+def _cache_key(text):
+    return hashlib.blake2b(text.strip().lower().encode("utf-8"), digest_size=16).hexdigest()
+
+async def _hf_one(session, sem, headers, text):
+    # 실패는 None으로 구분 (NEUTRAL로 바꿔치기하면 실패가 캐시에 박제됨)
+    payload = orjson.dumps({"inputs": text[:500]})
+    try:
+        async with sem:
+            async with session.post(HF_API_URL, headers=headers, data=payload,
+                                    timeout=aiohttp.ClientTimeout(total=10)) as r:
+                if r.status != 200:
+                    return None
+                js = await r.json()
+        arr = js[0] if isinstance(js, list) and js and isinstance(js[0], list) else js
+        if isinstance(arr, list):
+            top = max(arr, key=lambda x: x["score"])
+            return top["label"].upper()
+        return None
+    except:
+        return None
+
+async def _hf_all(texts):
+    # 캐시 히트를 먼저 채우고, 미스는 키 단위로 한 번만 호출
+    out = [None] * len(texts)
+    pending = {}
+    for i, t in enumerate(texts):
+        k = _cache_key(t)
+        cached = HF_CACHE.get(k)
+        if cached is not None:
+            out[i] = cached
+        else:
+            pending.setdefault(k, []).append(i)
+    if pending:
+        items = [(k, texts[idxs[0]]) for k, idxs in pending.items()]
+        headers = {"Authorization": f"Bearer {HF_TOKEN}", "Content-Type": "application/json"}
+        sem = asyncio.Semaphore(HF_CONCURRENCY)
+        connector = aiohttp.TCPConnector(limit=HF_CONCURRENCY)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            labels = await asyncio.gather(*[_hf_one(session, sem, headers, t) for _, t in items])
+        for (k, t), label in zip(items, labels):
+            if label is not None:  # 일시 오류(429/타임아웃)는 캐시하지 않고 다음에 재시도
+                HF_CACHE.set(k, label, expire=CACHE_TTL)
+            for i in pending[k]:
+                out[i] = label
+    return [l if l is not None else "NEUTRAL" for l in out]
+
+# 로컬 ONNX 감성 모델 (디렉터리가 있으면 HF API 대신 사용 — 네트워크/쿼터/키 불필요)
+# 준비(1회):
+#   optimum-cli export onnx --model cardiffnlp/twitter-xlm-roberta-base-sentiment \
+#       --task text-classification model_onnx/
+#   (INT8 동적 양자화 권장: optimum-cli onnxruntime quantize --onnx_model model_onnx ...)
+SENTIMENT_ONNX_DIR = os.getenv("SENTIMENT_ONNX_DIR", "model_onnx")
+SENTIMENT_BATCH_SIZE = 64
+_LOCAL_SENTIMENT = None  # (tokenizer, model) — 첫 사용 시 로드, 실패하면 False
+
+def _load_local_sentiment():
+    global _LOCAL_SENTIMENT
+    if _LOCAL_SENTIMENT is None:
+        if not os.path.isdir(SENTIMENT_ONNX_DIR):
+            _LOCAL_SENTIMENT = False
+            return None
+        try:
+            from transformers import AutoTokenizer
+            from optimum.onnxruntime import ORTModelForSequenceClassification
+            tok = AutoTokenizer.from_pretrained(SENTIMENT_ONNX_DIR)
+            model = ORTModelForSequenceClassification.from_pretrained(
+                SENTIMENT_ONNX_DIR, provider="CPUExecutionProvider")
+            _LOCAL_SENTIMENT = (tok, model)
+        except Exception as e:
+            print(f"Local sentiment model load failed: {e}")
+            _LOCAL_SENTIMENT = False
+    return _LOCAL_SENTIMENT or None
+
+def _local_sentiment_labels(texts):
+    tok, model = _LOCAL_SENTIMENT
+    id2label = getattr(model.config, "id2label", None) or {0: "NEGATIVE", 1: "NEUTRAL", 2: "POSITIVE"}
+    out = []
+    for i in range(0, len(texts), SENTIMENT_BATCH_SIZE):
+        batch = [t[:500] for t in texts[i:i + SENTIMENT_BATCH_SIZE]]
+        enc = tok(batch, padding=True, truncation=True, max_length=128, return_tensors="np")
+        logits = model(**enc).logits
+        out.extend(str(id2label[int(j)]).upper() for j in logits.argmax(-1))
+    return out
+
 def hf_sentiment_labels(texts):
+    if _load_local_sentiment():
+        try:
+            return _local_sentiment_labels(texts)
+        except Exception as e:
+            print(f"Local sentiment inference failed, falling back to API: {e}")
     if not HF_TOKEN: return ["NEUTRAL"] * len(texts)
-    HF_API_URL = "https://router.huggingface.co/hf-inference/models/cardiffnlp/twitter-xlm-roberta-base-sentiment"
-    headers = {"Authorization": f"Bearer {HF_TOKEN}"}
-    out = []
-    for t in texts:
-        payload = {"inputs": t[:500]} 
+    return asyncio.run(_hf_all(texts))
+
+PERSPECTIVE_BATCH_URL = "https://commentanalyzer.googleapis.com/batch"
+PERSPECTIVE_BATCH_SIZE = 20
+
+def _make_retry_session():
+    # 커넥션 풀 재사용으로 호출마다 드는 TLS 핸드셰이크 제거 + 일시 오류 자동 재시도
+    s = requests.Session()
+    s.mount("https://", HTTPAdapter(
+        pool_connections=16, pool_maxsize=32,
+        max_retries=Retry(total=3, backoff_factor=0.3,
+                          status_forcelist=[429, 500, 502, 503, 504])))
+    return s
+
+PERSPECTIVE_SESSION = _make_retry_session()
+
+class _TokenBucket:
+    """1 QPS 토큰 버킷: 무조건 sleep 대신 실제 소비량 기준으로만 대기"""
+    def __init__(self, rate=1.0, capacity=1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+
+    def acquire(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1.0:
+            time.sleep((1.0 - self.tokens) / self.rate)
+            self.tokens = 0.0
+            self.last = time.monotonic()
+        else:
+            self.tokens -= 1.0
+
+_PERSPECTIVE_BUCKET = _TokenBucket(rate=1.0, capacity=1.0)
+
+def _perspective_batch_body(texts, boundary, max_len=1500, lang="ko"):
+    # multipart/mixed (RFC2046): 내부 요청 하나당 comments:analyze POST 한 건
+    parts = []
+    for i, t in enumerate(texts):
+        data = {"comment": {"text": t[:max_len]}, "languages": [lang], "requestedAttributes": {"TOXICITY": {}}}
+        parts.append(
+            f"--{boundary}\r\n"
+            f"Content-Type: application/http\r\n"
+            f"Content-ID: <item{i}>\r\n\r\n"
+            f"POST /v1alpha1/comments:analyze?key={PERSPECTIVE_API_KEY} HTTP/1.1\r\n"
+            f"Content-Type: application/json\r\n\r\n"
+            f"{orjson.dumps(data).decode()}\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n")
+    return "".join(parts).encode("utf-8")
+
+def _perspective_parse_batch(content_type, body, n):
+    # 파싱 실패분은 None 유지 (실패를 0.0으로 캐시하지 않도록)
+    scores = [None] * n
+    m = re.search(r'boundary=([^;]+)', content_type or "")
+    if not m: return scores
+    boundary = m.group(1).strip().strip('"')
+    for part in body.split("--" + boundary):
+        cid = re.search(r"Content-ID:\s*<response-item(\d+)>", part)
+        brace = part.find("{")
+        if not cid or brace < 0: continue
         try:
-            r = requests.post(HF_API_URL, headers=headers, json=payload, timeout=5)
-            if r.status_code == 200:
-                js = r.json()
-                arr = js[0] if isinstance(js, list) and js and isinstance(js[0], list) else js
-                if isinstance(arr, list):
-                    top = max(arr, key=lambda x: x["score"])
-                    out.append(top["label"].upper())
-                else: out.append("NEUTRAL")
-            else: out.append("NEUTRAL")
-        except: out.append("NEUTRAL")
-        time.sleep(0.1)
-    return out
+            js = orjson.loads(part[brace:])
+            val = js.get("attributeScores", {}).get("TOXICITY", {}).get("summaryScore", {}).get("value", 0.0)
+            scores[int(cid.group(1))] = float(val)
+        except: pass
+    return scores
 
-def perspective_toxicity_scores(texts):
-    if not PERSPECTIVE_API_KEY: return [0.0] * len(texts)
-    PERSPECTIVE_URL = "https://commentanalyzer.googleapis.com/v1alpha1/comments:analyze"
+def _perspective_fetch(texts):
     scores = []
-    for t in texts:
+    for i in range(0, len(texts), PERSPECTIVE_BATCH_SIZE):
+        chunk = texts[i:i + PERSPECTIVE_BATCH_SIZE]
         try:
-            data = {"comment": {"text": t[:1500]}, "languages": ["ko"], "requestedAttributes": {"TOXICITY": {}}}
-            r = requests.post(f"{PERSPECTIVE_URL}?key={PERSPECTIVE_API_KEY}", json=data, timeout=5)
+            # 쿼터는 내부 요청 단위로 집계되므로 건수만큼 토큰을 소비
+            for _ in chunk:
+                _PERSPECTIVE_BUCKET.acquire()
+            boundary = f"batch_{uuid.uuid4().hex}"
+            r = PERSPECTIVE_SESSION.post(
+                PERSPECTIVE_BATCH_URL,
+                data=_perspective_batch_body(chunk, boundary),
+                headers={"Content-Type": f"multipart/mixed; boundary={boundary}"},
+                timeout=30)
             if r.status_code == 200:
-                val = r.json().get("attributeScores", {}).get("TOXICITY", {}).get("summaryScore", {}).get("value", 0.0)
-                scores.append(float(val))
-            else: scores.append(0.0)
-        except: scores.append(0.0)
-        time.sleep(1.1)
+                scores.extend(_perspective_parse_batch(r.headers.get("Content-Type"), r.text, len(chunk)))
+            else:
+                scores.extend([None] * len(chunk))
+        except:
+            scores.extend([None] * len(chunk))
     return scores
 
+def perspective_toxicity_scores(texts):
+    if not PERSPECTIVE_API_KEY: return [0.0] * len(texts)
+    out = [None] * len(texts)
+    pending = {}
+    for i, t in enumerate(texts):
+        k = _cache_key(t)
+        cached = PERSP_CACHE.get(k)
+        if cached is not None:
+            out[i] = cached
+        else:
+            pending.setdefault(k, []).append(i)
+    if pending:
+        items = [(k, texts[idxs[0]]) for k, idxs in pending.items()]
+        fetched = _perspective_fetch([t for _, t in items])
+        for (k, t), score in zip(items, fetched):
+            if score is not None:  # 일시 오류는 캐시하지 않고 다음에 재시도
+                PERSP_CACHE.set(k, score, expire=CACHE_TTL)
+            for i in pending[k]:
+                out[i] = score
+    return [s if s is not None else 0.0 for s in out]
+
+def _ratios(labels):
+    """감성 라벨 리스트 → (긍정 비율, 부정 비율)"""
+    c = Counter(labels)
+    n = len(labels) or 1
+    return c.get("POSITIVE", 0) / n, c.get("NEGATIVE", 0) / n
+
+BIG5_LABELS = ("openness", "conscientiousness", "extraversion", "agreeableness", "neuroticism")
+
+# 성향별 가중치 행렬 (행: BIG5_LABELS 순서, 열: 아래 features 순서)
+_BIG5_COEF = np.array([
+    # ttr  topic cert  1-tox len20 pos   len15 self  unc   neg   tox
+    [0.7,  0.3,  0.0,  0.0,  0.0,  0.0,  0.0,  0.0,  0.0,  0.0,  0.0],  # openness
+    [0.0,  0.0,  0.4,  0.3,  0.3,  0.0,  0.0,  0.0,  0.0,  0.0,  0.0],  # conscientiousness
+    [0.0,  0.0,  0.0,  0.0,  0.0,  0.4,  0.3,  0.3,  0.0,  0.0,  0.0],  # extraversion
+    [0.0,  0.0,  0.0,  0.5,  0.0,  0.3,  0.0,  0.0,  0.2,  0.0,  0.0],  # agreeableness
+    [0.0,  0.0,  0.0,  0.0,  0.0,  0.0,  0.0,  0.0,  0.3,  0.5,  0.2],  # neuroticism
+])
+
 def infer_bigfive_korean(summary):
     s = summary
     st = s["style"]
-    
+
     def normalize(val, scale=1.0):
         return min(1.0, val * scale)
 
-    openness = (0.7 * normalize(st["ttr"], 2.0)) + (0.3 * s.get("topic_div", 0.5))
-    conscientiousness = (0.4 * normalize(st["certainty"], 10.0)) + (0.3 * (1 - s["toxicity_avg"])) + (0.3 * normalize(st["avg_len"] / 20))
-    extraversion = (0.4 * s["positive_ratio"]) + (0.3 * normalize(st["avg_len"] / 15)) + (0.3 * normalize(st["self_ref"], 10.0))
-    agreeableness = (0.5 * (1 - s["toxicity_avg"])) + (0.3 * s["positive_ratio"]) + (0.2 * normalize(st["uncertainty"], 5.0))
-    neuroticism = (0.5 * s["negative_ratio"]) + (0.3 * normalize(st["uncertainty"], 5.0)) + (0.2 * s["toxicity_avg"])
-
-    return {
-        "openness": round(openness * 100, 2),
-        "conscientiousness": round(conscientiousness * 100, 2),
-        "extraversion": round(extraversion * 100, 2),
-        "agreeableness": round(agreeableness * 100, 2),
-        "neuroticism": round(neuroticism * 100, 2),
-    }
+    features = np.array([
+        normalize(st["ttr"], 2.0),
+        s.get("topic_div", 0.5),
+        normalize(st["certainty"], 10.0),
+        1 - s["toxicity_avg"],
+        normalize(st["avg_len"] / 20),
+        s["positive_ratio"],
+        normalize(st["avg_len"] / 15),
+        normalize(st["self_ref"], 10.0),
+        normalize(st["uncertainty"], 5.0),
+        s["negative_ratio"],
+        s["toxicity_avg"],
+    ])
+
+    scores = np.minimum(1.0, _BIG5_COEF @ features) * 100
+    return dict(zip(BIG5_LABELS, np.round(scores, 2).tolist()))
 
 def calculate_mbti_and_reasoning(big5, summary_data):
     e_type = 'E' if big5['extraversion'] >= 50 else 'I'
@@ -220,7 +473,12 @@ def calculate_mbti_and_reasoning(big5, summary_data):
 # [2] Flask 라우팅
 # -----------------------
 def get_db_connection():
-    return pymysql.connect(**db_config)
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:  # 동시 첫 요청이 풀을 중복 생성해 커넥션을 흘리지 않도록
+            if _POOL is None:
+                _POOL = PooledDB(creator=pymysql, maxconnections=16, mincached=2, blocking=True, **_db_config())
+    return _POOL.connection()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -287,14 +545,78 @@ def upload_page():
     if 'user_id' not in session: return redirect(url_for('login'))
     return render_template('upload.html', nickname=session['nickname'])
 
+def process_chat(file_path, user_id, target_name, filename, file_hash=None):
+    """업로드된 대화 분석 파이프라인 본체. RQ 워커에서 실행되어 log_id 반환."""
+    my_sentences = list(iter_target_sentences(file_path, target_name))
+
+    if len(my_sentences) < 5:
+        raise ValueError(f"'{target_name}'님의 대화 내용이 너무 적습니다. 이름을 확인해주세요.")
+
+    # 중복 발화는 한 번만 점수화하고(짧은 답장은 수십 번 반복됨) 원래 순서로 복원
+    uniq = list(dict.fromkeys(my_sentences))
+    lmap = dict(zip(uniq, hf_sentiment_labels(uniq)))
+    tmap = dict(zip(uniq, perspective_toxicity_scores(uniq)))
+    senti_labels = [lmap[s] for s in my_sentences]
+    tox_scores = [tmap[s] for s in my_sentences]
+    korean_style = analyze_korean_style(my_sentences)
+
+    n = len(my_sentences)
+    pos_ratio, neg_ratio = _ratios(senti_labels)
+    tox_avg = float(np.mean(tox_scores)) if tox_scores else 0.0
+
+    summary_data = {
+        "positive_ratio": float(pos_ratio),
+        "negative_ratio": float(neg_ratio),
+        "toxicity_avg": float(tox_avg),
+        "style": korean_style,
+        "topic_div": float(min(1.0, len(set(my_sentences)) / n))
+    }
+
+    big5_result = infer_bigfive_korean(summary_data)
+    mbti_prediction, reasoning_text = calculate_mbti_and_reasoning(big5_result, summary_data)
+
+    summary_text = (f"총 {n}문장 분석 완료. 긍정 {pos_ratio*100:.1f}%, 독성 {tox_avg:.3f}")
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            # 두 INSERT를 한 번의 서버 왕복으로 전송 (log_id는 LAST_INSERT_ID로 연결)
+            sql = """
+            INSERT INTO chat_logs (user_id, file_name, file_path, target_name, hash_bytes, process_status) VALUES (%s, %s, %s, %s, %s, 'COMPLETED');
+            SET @log_id = LAST_INSERT_ID();
+            INSERT INTO personality_results
+            (user_id, log_id, openness, conscientiousness, extraversion, agreeableness, neuroticism,
+             summary_text, mbti_prediction, reasoning_text, toxicity_score, sentiment_pos_ratio, sentiment_neg_ratio)
+            VALUES (%s, @log_id, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """
+            cursor.execute(sql, (
+                user_id, filename, file_path, target_name, file_hash,
+                user_id,
+                big5_result['openness'], big5_result['conscientiousness'],
+                big5_result['extraversion'], big5_result['agreeableness'],
+                big5_result['neuroticism'],
+                summary_text, mbti_prediction, reasoning_text,
+                tox_avg, pos_ratio, neg_ratio
+            ))
+            log_id = cursor.lastrowid  # 첫 INSERT(chat_logs)의 PK
+            while cursor.nextset():  # 남은 결과 셋 소진 후 commit
+                pass
+        conn.commit()
+        return log_id
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
 @app.route('/api/upload_chat', methods=['POST'])
 def upload_api():
     if 'user_id' not in session: return redirect(url_for('login'))
     if 'chat_file' not in request.files: return redirect(request.url)
-    
+
     file = request.files['chat_file']
     target_name = request.form.get('target_name', '').strip()
-    
+
     if not target_name:
         flash('분석할 대화명을 입력해주세요.')
         return redirect(request.url)
@@ -303,79 +625,60 @@ def upload_api():
         filename = secure_filename(file.filename)
         save_name = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{filename}"
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], save_name)
-        file.save(file_path)
-        
-        user_id = session['user_id']
+
+        # 저장하면서 스트리밍 해시 (파일을 두 번 읽지 않음)
+        h = hashlib.blake2b(digest_size=32)
+        with open(file_path, "wb") as out:
+            chunk = file.stream.read(1 << 20)
+            while chunk:
+                h.update(chunk)
+                out.write(chunk)
+                chunk = file.stream.read(1 << 20)
+        file_hash = h.hexdigest()
+
+        # 같은 사용자가 같은 파일·대화명을 재업로드하면 기존 결과로 바로 이동
         conn = get_db_connection()
-        
         try:
-            rows = parse_kakao_txt(file_path)
-            my_sentences = []
-            for r in rows:
-                if r["speaker"] == target_name:
-                    txt = r["text"]
-                    if txt and txt not in SKIP_TOKENS:
-                        cleaned = clean_text(txt)
-                        if cleaned: my_sentences.append(cleaned)
-            
-            if len(my_sentences) < 5:
-                flash(f"'{target_name}'님의 대화 내용이 너무 적습니다. 이름을 확인해주세요.")
-                return redirect(url_for('upload_page'))
-
-            senti_labels = hf_sentiment_labels(my_sentences)
-            tox_scores = perspective_toxicity_scores(my_sentences)
-            korean_style = analyze_korean_style(my_sentences)
-            
-            cnt = pd.Series(senti_labels).value_counts()
-            n = len(my_sentences)
-            pos_ratio = cnt.get("POSITIVE", 0) / n
-            neg_ratio = cnt.get("NEGATIVE", 0) / n
-            tox_avg = float(np.mean(tox_scores)) if tox_scores else 0.0
-            
-            summary_data = {
-                "positive_ratio": float(pos_ratio),
-                "negative_ratio": float(neg_ratio),
-                "toxicity_avg": float(tox_avg),
-                "style": korean_style,
-                "topic_div": float(min(1.0, len(set(my_sentences)) / n))
-            }
-            
-            big5_result = infer_bigfive_korean(summary_data)
-            mbti_prediction, reasoning_text = calculate_mbti_and_reasoning(big5_result, summary_data)
-            
-            summary_text = (f"총 {n}문장 분석 완료. 긍정 {pos_ratio*100:.1f}%, 독성 {tox_avg:.3f}")
-
             with conn.cursor() as cursor:
-                sql_log = "INSERT INTO chat_logs (user_id, file_name, file_path, target_name, process_status) VALUES (%s, %s, %s, %s, 'COMPLETED')"
-                cursor.execute(sql_log, (user_id, filename, file_path, target_name))
-                log_id = cursor.lastrowid
-                
-                sql_result = """
-                INSERT INTO personality_results 
-                (user_id, log_id, openness, conscientiousness, extraversion, agreeableness, neuroticism, 
-                 summary_text, mbti_prediction, reasoning_text, toxicity_score, sentiment_pos_ratio, sentiment_neg_ratio)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """
-                cursor.execute(sql_result, (
-                    user_id, log_id,
-                    big5_result['openness'], big5_result['conscientiousness'], 
-                    big5_result['extraversion'], big5_result['agreeableness'], 
-                    big5_result['neuroticism'], 
-                    summary_text, mbti_prediction, reasoning_text,
-                    tox_avg, pos_ratio, neg_ratio
-                ))
-            conn.commit()
-            return redirect(url_for('result_page', log_id=log_id))
-            
+                cursor.execute(
+                    "SELECT log_id FROM chat_logs WHERE user_id = %s AND hash_bytes = %s AND target_name = %s AND process_status = 'COMPLETED' ORDER BY log_id DESC LIMIT 1",
+                    (session['user_id'], file_hash, target_name))
+                dup = cursor.fetchone()
+        finally:
+            conn.close()
+        if dup:
+            os.remove(file_path)
+            flash("이미 분석한 파일입니다. 기존 결과를 보여드립니다.")
+            return redirect(url_for('result_page', log_id=dup['log_id']))
+
+        # 분석(외부 API 대기 포함)은 워커에 맡기고 요청 스레드는 바로 반환
+        # (문자열 경로로 등록: python app.py로 띄우면 __module__이 __main__이라 rq가 거부함)
+        try:
+            job = TASK_QUEUE.enqueue('app.process_chat', file_path, session['user_id'],
+                                     target_name, filename, file_hash, job_timeout=1800)
         except Exception as e:
-            conn.rollback()
             print(e)
             flash(f"오류 발생: {str(e)}")
             return redirect(url_for('upload_page'))
-        finally:
-            conn.close()
+        return redirect(url_for('pending_page', job_id=job.id))
     return redirect(url_for('upload_page'))
 
+@app.route('/pending/<job_id>')
+def pending_page(job_id):
+    if 'user_id' not in session: return redirect(url_for('login'))
+    job = TASK_QUEUE.fetch_job(job_id)
+    if job is None:
+        flash("분석 작업을 찾을 수 없습니다.")
+        return redirect(url_for('upload_page'))
+    status = job.get_status()
+    if status == 'finished':
+        return redirect(url_for('result_page', log_id=job.result))
+    if status == 'failed':
+        print(job.exc_info)
+        flash("분석 중 오류가 발생했습니다. 파일과 대화명을 확인해주세요.")
+        return redirect(url_for('upload_page'))
+    return render_template('pending.html', nickname=session['nickname'], job_id=job_id)
+
 @app.route('/result/<int:log_id>')
 def result_page(log_id):
     if 'user_id' not in session: return redirect(url_for('login'))
@@ -398,4 +701,5 @@ def result_page(log_id):
         conn.close()
 
 if __name__ == '__main__':
+    _resolve_db_credentials()
     app.run(debug=True, port=5000)
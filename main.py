@@ -13,18 +13,30 @@ main.py
 
 import os
 import re
-import json
+import csv
 import time
+import uuid
+import glob
+import asyncio
 import statistics
 import argparse
+import multiprocessing
 from pathlib import Path
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
-import numpy as np
-import pandas as pd
+import aiohttp
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
+try:
+    import re2 as _re  # DFA 기반 엔진: 비정상 라인에서도 백트래킹 폭주 없이 선형 시간
+except ImportError:
+    _re = re
+
 # -----------------------
 # 환경변수 로드
 # -----------------------
@@ -35,29 +47,32 @@ PERSPECTIVE_API_KEY = os.getenv("PERSPECTIVE_API_KEY")  # Google Perspective API
 # -----------------------
 # 카톡 파서
 # -----------------------
-LINE_RE = re.compile(r"^\[(?P<name>.+?)\]\s+\[(?P<time>\d{1,2}:\d{2})\]\s+(?P<msg>.+)$")
-SKIP_TOKENS = {"사진", "이모티콘", "동영상", "삭제된 메시지입니다."}
+# bytes 패턴: 비매칭 라인(파일의 대부분)은 UTF-8 디코드 없이 건너뜀
+LINE_RE = _re.compile(rb"^\[(?P<name>.+?)\]\s+\[(?P<time>\d{1,2}:\d{2})\]\s+(?P<msg>.+)$")
+SKIP_TOKENS = frozenset({"사진", "이모티콘", "동영상", "삭제된 메시지입니다."})
 
 def parse_kakao_txt(path: str):
     rows = []
-    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+    with open(path, "rb", buffering=1 << 20) as f:
         for line in f:
-            line = line.rstrip("\n")
+            line = line.rstrip(b"\r\n")
             m = LINE_RE.match(line)
             if not m:
                 continue
             rows.append({
-                "speaker": m.group("name").strip(),
-                "time": m.group("time"),
-                "text": m.group("msg").strip(),
-                "raw": line,
+                "speaker": m.group("name").decode("utf-8", "ignore").strip(),
+                "time": m.group("time").decode("ascii", "ignore"),
+                "text": m.group("msg").decode("utf-8", "ignore").strip(),
+                "raw": line.decode("utf-8", "ignore"),
             })
     return rows
 
+# 메시지 수만큼 호출되므로 모듈 로드 시 1회만 컴파일
+_URL = _re.compile(r"https?://\S+")
+_WS = _re.compile(r"\s+")
+
 def clean_text(t: str) -> str:
-    t = re.sub(r"https?://\S+", " ", t)
-    t = re.sub(r"\s+", " ", t).strip()
-    return t
+    return _WS.sub(" ", _URL.sub(" ", t)).strip()
 
 def split_sentences(t: str):
     parts = re.split(r"(?<=[.!?])\s+|\n+", t)
@@ -68,55 +83,146 @@ def split_sentences(t: str):
 # -----------------------
 HF_API = "https://router.huggingface.co/hf-inference/models/cardiffnlp/twitter-xlm-roberta-base-sentiment"
 
+HF_CONCURRENCY = 8  # 동시 요청 수 (세마포어로 QPS 제한)
+
+async def _hf_one(session, sem, headers, text):
+    payload = orjson.dumps({"inputs": text[:800]})  # 과도한 길이 방지
+    async with sem:
+        async with session.post(HF_API, headers=headers, data=payload,
+                                timeout=aiohttp.ClientTimeout(total=30)) as r:
+            if r.status == 503:  # 모델 웜업 대기 후 1회 재시도
+                await asyncio.sleep(2)
+                async with session.post(HF_API, headers=headers, data=payload,
+                                        timeout=aiohttp.ClientTimeout(total=30)) as r2:
+                    r2.raise_for_status()
+                    js = await r2.json()
+            else:
+                r.raise_for_status()
+                js = await r.json()
+    # 응답: [[{label, score}, ...]] 또는 [{label, score}, ...]
+    arr = js[0] if isinstance(js, list) and js and isinstance(js[0], list) else js
+    top = max(arr, key=lambda x: x["score"])
+    return top["label"].upper()
+
+async def _hf_all(texts):
+    headers = {"Authorization": f"Bearer {HF_TOKEN}"} if HF_TOKEN else {}
+    headers["Content-Type"] = "application/json"
+    sem = asyncio.Semaphore(HF_CONCURRENCY)
+    connector = aiohttp.TCPConnector(limit=HF_CONCURRENCY)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        return list(await asyncio.gather(*[_hf_one(session, sem, headers, t) for t in texts]))
+
 def hf_sentiment_labels(texts):
     """
     다국어 감성 분석: POSITIVE / NEGATIVE / NEUTRAL
-    무료 할당량 보호를 위해 단건 호출 + 약간의 대기
+    세마포어로 동시 8건까지 병렬 호출 (기존 단건 순차 호출 대비 대폭 단축)
     """
-    headers = {"Authorization": f"Bearer {HF_TOKEN}"} if HF_TOKEN else {}
-    out = []
-    for t in texts:
-        payload = {"inputs": t[:800]}  # 과도한 길이 방지
-        r = requests.post(HF_API, headers=headers, json=payload, timeout=30)
-        if r.status_code == 503:
-            time.sleep(2)
-            r = requests.post(HF_API, headers=headers, json=payload, timeout=30)
-        r.raise_for_status()
-        js = r.json()
-        # 응답: [[{label, score}, ...]] 또는 [{label, score}, ...]
-        arr = js[0] if isinstance(js, list) and js and isinstance(js[0], list) else js
-        top = max(arr, key=lambda x: x["score"])
-        out.append(top["label"].upper())
-        time.sleep(0.2)  # QPS 여유
-    return out
+    return asyncio.run(_hf_all(texts))
 
 PERSPECTIVE_URL = "https://commentanalyzer.googleapis.com/v1alpha1/comments:analyze"
+PERSPECTIVE_BATCH_URL = "https://commentanalyzer.googleapis.com/batch"
+PERSPECTIVE_BATCH_SIZE = 20
+
+def _make_retry_session():
+    # 커넥션 풀 재사용으로 호출마다 드는 TLS 핸드셰이크 제거 + 일시 오류 자동 재시도
+    s = requests.Session()
+    s.mount("https://", HTTPAdapter(
+        pool_connections=16, pool_maxsize=32,
+        max_retries=Retry(total=3, backoff_factor=0.3,
+                          status_forcelist=[429, 500, 502, 503, 504])))
+    return s
+
+PERSPECTIVE_SESSION = _make_retry_session()
+
+class _TokenBucket:
+    """1 QPS 토큰 버킷: 무조건 sleep(1.05) 대신 소비량 기준으로만 대기"""
+    def __init__(self, rate=1.0, capacity=1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+
+    def acquire(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1.0:
+            time.sleep((1.0 - self.tokens) / self.rate)
+            self.tokens = 0.0
+            self.last = time.monotonic()
+        else:
+            self.tokens -= 1.0
+
+_PERSPECTIVE_BUCKET = _TokenBucket(rate=1.0, capacity=1.0)
+
+def _perspective_batch_body(texts, boundary, lang="ko"):
+    # multipart/mixed (RFC2046): 내부 요청 하나당 comments:analyze POST 한 건
+    parts = []
+    for i, t in enumerate(texts):
+        data = {
+            "comment": {"text": t[:2000]},
+            "languages": [lang],
+            "requestedAttributes": {"TOXICITY": {}}
+        }
+        parts.append(
+            f"--{boundary}\r\n"
+            f"Content-Type: application/http\r\n"
+            f"Content-ID: <item{i}>\r\n\r\n"
+            f"POST /v1alpha1/comments:analyze?key={PERSPECTIVE_API_KEY} HTTP/1.1\r\n"
+            f"Content-Type: application/json\r\n\r\n"
+            f"{orjson.dumps(data).decode()}\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n")
+    return "".join(parts).encode("utf-8")
+
+def _perspective_parse_batch(content_type, body, n):
+    scores = [0.0] * n
+    m = re.search(r'boundary=([^;]+)', content_type or "")
+    if not m:
+        return scores
+    boundary = m.group(1).strip().strip('"')
+    for part in body.split("--" + boundary):
+        cid = re.search(r"Content-ID:\s*<response-item(\d+)>", part)
+        brace = part.find("{")
+        if not cid or brace < 0:
+            continue
+        js = orjson.loads(part[brace:])
+        val = js.get("attributeScores", {}).get("TOXICITY", {}).get("summaryScore", {}).get("value", 0.0)
+        scores[int(cid.group(1))] = float(val)
+    return scores
 
 def perspective_toxicity_scores(texts, lang="ko"):
     """
-    독성(TOXICITY) 0~1 점수. 기본 1 QPS 제한 → 호출 간 1초 간격.
+    독성(TOXICITY) 0~1 점수. 배치 엔드포인트로 20건씩 한 번에 전송.
+    쿼터는 내부 요청 단위로 집계되므로 토큰 버킷으로 1 QPS 유지.
     키가 없으면 0.0으로 대체.
     """
     if not PERSPECTIVE_API_KEY:
         return [0.0] * len(texts)
     scores = []
-    for t in texts:
-        data = {
-            "comment": {"text": t[:2000]},
-            "languages": [lang],
-            "requestedAttributes": {"TOXICITY": {}}
-        }
-        r = requests.post(f"{PERSPECTIVE_URL}?key={PERSPECTIVE_API_KEY}", json=data, timeout=30)
+    for i in range(0, len(texts), PERSPECTIVE_BATCH_SIZE):
+        chunk = texts[i:i + PERSPECTIVE_BATCH_SIZE]
+        for _ in chunk:
+            _PERSPECTIVE_BUCKET.acquire()
+        boundary = f"batch_{uuid.uuid4().hex}"
+        r = PERSPECTIVE_SESSION.post(
+            PERSPECTIVE_BATCH_URL,
+            data=_perspective_batch_body(chunk, boundary, lang=lang),
+            headers={"Content-Type": f"multipart/mixed; boundary={boundary}"},
+            timeout=30)
         r.raise_for_status()
-        js = r.json()
-        val = js.get("attributeScores", {}).get("TOXICITY", {}).get("summaryScore", {}).get("value", 0.0)
-        scores.append(float(val))
-        time.sleep(1.05)  # 1 QPS
+        scores.extend(_perspective_parse_batch(r.headers.get("Content-Type"), r.text, len(chunk)))
     return scores
 
 # -----------------------
 # 간단 스타일 지표 & 빅파이브(탐색적)
 # -----------------------
+def _ratios(labels):
+    """감성 라벨 리스트 → (긍정 비율, 부정 비율)"""
+    c = Counter(labels)
+    n = len(labels) or 1
+    return c.get("POSITIVE", 0) / n, c.get("NEGATIVE", 0) / n
+
 def style_metrics(sentences):
     joined = " ".join(sentences)
     toks = joined.split()
@@ -152,14 +258,17 @@ def write_report(outdir, per_sent_records, summary, big5):
     out = Path(outdir)
     out.mkdir(parents=True, exist_ok=True)
 
-    # CSV
-    pd.DataFrame(per_sent_records).to_csv(out / "utterances.csv", index=False, encoding="utf-8-sig")
+    # CSV (3개 컬럼 고정이라 DataFrame 없이 stdlib csv로 바로 기록)
+    with open(out / "utterances.csv", "w", encoding="utf-8-sig", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=["sentence", "sentiment", "toxicity"])
+        w.writeheader()
+        w.writerows(per_sent_records)
 
-    # JSON
-    (out / "report.json").write_text(json.dumps({
+    # JSON (orjson은 UTF-8 bytes를 바로 내므로 encode 단계가 없음)
+    (out / "report.json").write_bytes(orjson.dumps({
         "summary": summary,
         "big_five_exploratory": big5
-    }, ensure_ascii=False, indent=2), encoding="utf-8")
+    }, option=orjson.OPT_INDENT_2))
 
     # Markdown
     md = []
@@ -179,22 +288,22 @@ def write_report(outdir, per_sent_records, summary, big5):
 # -----------------------
 # 메인 실행
 # -----------------------
-def main():
-    parser = argparse.ArgumentParser(description="카카오톡 대화 성격 분석 (무료 API 사용)")
-    parser.add_argument("-f", "--file", required=True, help="카카오톡 내보내기 txt 경로")
-    parser.add_argument("-o", "--outdir", default="out_report", help="리포트 출력 폴더")
-    args = parser.parse_args()
+_START_SEM = None  # 워커 기동 시차용 (동시 기동 시 429 회피)
 
-    if not HF_TOKEN:
-        raise SystemExit("환경변수 HF_TOKEN 이 없습니다. .env 파일을 확인하세요. (Hugging Face Inference API 토큰)")
-    if not PERSPECTIVE_API_KEY:
-        print("[경고] PERSPECTIVE_API_KEY 가 없습니다. 독성 점수는 0으로 처리됩니다.")
+def _pool_init(sem):
+    global _START_SEM
+    _START_SEM = sem
 
-    my_name = input("카톡 대화에서 본인 이름(표시명)을 입력하세요: ").strip()
-    if not my_name:
-        raise SystemExit("이름이 비어 있습니다.")
+def _process_one(task):
+    """파일 1개 분석 → 리포트 저장. (워커 프로세스에서 실행, 세션/토큰버킷은 프로세스별 소유)"""
+    path, my_name, outdir = task
+    tag = Path(path).name
+
+    if _START_SEM is not None:
+        with _START_SEM:
+            time.sleep(0.5)
 
-    rows = parse_kakao_txt(args.file)
+    rows = parse_kakao_txt(path)
 
     # 내 발화만 추출 → 문장화
     sentences = []
@@ -210,24 +319,27 @@ def main():
     # 너무 짧은 문장 제거
     sentences = [s for s in sentences if len(s.split()) >= 3]
     if len(sentences) == 0:
-        raise SystemExit("분석할 문장이 없습니다. 파일/이름을 확인하세요.")
+        print(f"[경고] {tag}: 분석할 문장이 없습니다. 파일/이름을 확인하세요.")
+        return None
     if len(sentences) < 10:
-        print(f"[안내] 문장 수가 {len(sentences)}개로 적어 결과 신뢰도가 낮을 수 있습니다.")
+        print(f"[안내] {tag}: 문장 수가 {len(sentences)}개로 적어 결과 신뢰도가 낮을 수 있습니다.")
 
-    # 무료 API 호출
-    print("[진행] 감성 분석(Hugging Face Inference API)...")
-    senti_labels = hf_sentiment_labels(sentences)  # POSITIVE/NEGATIVE/NEUTRAL
+    # 무료 API 호출 (중복 문장은 한 번만 보내고 원래 순서로 복원)
+    uniq = list(dict.fromkeys(sentences))
 
-    print("[진행] 독성 분석(Google Perspective API)...")
-    tox_scores = perspective_toxicity_scores(sentences, lang="ko")  # 0~1 (키 없으면 0)
+    print(f"[진행] {tag}: 감성 분석(Hugging Face Inference API)... (고유 문장 {len(uniq)}/{len(sentences)})")
+    lmap = dict(zip(uniq, hf_sentiment_labels(uniq)))  # POSITIVE/NEGATIVE/NEUTRAL
+    senti_labels = [lmap[s] for s in sentences]
+
+    print(f"[진행] {tag}: 독성 분석(Google Perspective API)...")
+    tmap = dict(zip(uniq, perspective_toxicity_scores(uniq, lang="ko")))  # 0~1 (키 없으면 0)
+    tox_scores = [tmap[s] for s in sentences]
 
     # 요약
     n = len(sentences)
-    cnt = Counter(senti_labels)
-    pos = cnt.get("POSITIVE", 0) / n
-    neg = cnt.get("NEGATIVE", 0) / n
+    pos, neg = _ratios(senti_labels)
     neu = 1 - pos - neg
-    tox_avg = float(np.mean(tox_scores)) if tox_scores else 0.0
+    tox_avg = sum(tox_scores) / len(tox_scores) if tox_scores else 0.0
     style = style_metrics(sentences)
     topic_div = float(min(1.0, 0.5 + 0.5 * (len(set(sentences)) / n)))  # 간단 근사
 
@@ -248,8 +360,43 @@ def main():
     big5 = infer_bigfive(summary)
 
     # 저장
-    write_report(args.outdir, per_sent, summary, big5)
-    print(f"[완료] 리포트 생성: {Path(args.outdir).resolve()} (summary.md / report.json / utterances.csv)")
+    write_report(outdir, per_sent, summary, big5)
+    print(f"[완료] {tag}: 리포트 생성: {Path(outdir).resolve()} (summary.md / report.json / utterances.csv)")
+    return outdir
+
+def main():
+    parser = argparse.ArgumentParser(description="카카오톡 대화 성격 분석 (무료 API 사용)")
+    parser.add_argument("-f", "--files", required=True, nargs="+",
+                        help="카카오톡 내보내기 txt 경로 (글롭 패턴/여러 개 가능)")
+    parser.add_argument("-o", "--outdir", default="out_report", help="리포트 출력 폴더")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 4,
+                        help="파일 단위 병렬 처리 프로세스 수")
+    args = parser.parse_args()
+
+    if not HF_TOKEN:
+        raise SystemExit("환경변수 HF_TOKEN 이 없습니다. .env 파일을 확인하세요. (Hugging Face Inference API 토큰)")
+    if not PERSPECTIVE_API_KEY:
+        print("[경고] PERSPECTIVE_API_KEY 가 없습니다. 독성 점수는 0으로 처리됩니다.")
+
+    files = sorted({p for pat in args.files for p in glob.glob(pat)})
+    if not files:
+        raise SystemExit("입력 파일이 없습니다. 경로/글롭 패턴을 확인하세요.")
+
+    my_name = input("카톡 대화에서 본인 이름(표시명)을 입력하세요: ").strip()
+    if not my_name:
+        raise SystemExit("이름이 비어 있습니다.")
+
+    # 파일 1개면 기존처럼 outdir에 바로, 여러 개면 파일명별 하위 폴더에 저장
+    if len(files) == 1:
+        _process_one((files[0], my_name, args.outdir))
+        return
+
+    tasks = [(p, my_name, str(Path(args.outdir) / Path(p).stem)) for p in files]
+    sem = multiprocessing.Semaphore(1)
+    workers = min(args.workers, len(files))
+    print(f"[진행] {len(files)}개 파일을 {workers}개 프로세스로 병렬 분석합니다.")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_pool_init, initargs=(sem,)) as ex:
+        list(ex.map(_process_one, tasks))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file